@@ -1,12 +1,165 @@
+from __future__ import annotations
+
+import copy
+import dbm
+import io
+import math
+import os
+import shelve
+import time
 import tomllib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from operator import attrgetter
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import (
+    TYPE_CHECKING,
+    ClassVar,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+# osxphotos, geopy, PIL and the optional scikit-learn/Numba accelerators are
+# imported where they are used, so importing this module stays cheap.
+if TYPE_CHECKING:
+    import osxphotos
+
+EARTH_RADIUS_KM = 6371.0
+# Below this many bbox survivors the scalar kernel beats NumPy's per-call overhead
+SCALAR_MAX_CANDIDATES = 8
+# Bit flags for the media kind column
+_KIND_PHOTO = 1
+_KIND_VIDEO = 2
+_MEDIA_TYPE_KINDS = {"photo": _KIND_PHOTO, "video": _KIND_VIDEO}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+GEOCACHE_PATH = Path.home() / ".macphotosfilter_geocache"
+GEOCACHE_TTL = timedelta(days=90)
+# Successful geocodes for this process, keyed on (address, user_agent)
+_geocode_memo: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+
+class MediaInfo(NamedTuple):
+    """
+    Summary row for a filtered media item; see MacPhotosFilter.list_media_info.
+    Use ._asdict() for a dict, or pass a list straight to pandas.DataFrame.
+    """
+
+    filename: str
+    date: datetime
+    location: Tuple[Optional[float], Optional[float]]
+    path: Optional[str]
+    type: str
+
+
+def haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """
+    Great-circle distance in km between two (lat, lon) points in degrees.
+    """
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def _to_datetime64(dt: datetime) -> np.datetime64:
+    """
+    Exact UTC microsecond datetime64 for a datetime; naive datetimes are
+    taken as UTC, matching MacPhotosFilter.filter_media's date bounds.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return np.datetime64((dt - _EPOCH) // _ONE_MICROSECOND, "us")
+
+
+def _haversine_km_loop(lats, lons, rlat, rlon, cos_rlat):
+    """
+    Haversine distances in km from a target given in radians (with its
+    precomputed cosine) to arrays of latitudes/longitudes in degrees.
+    Written as one fused loop for Numba; see _haversine_km_jit.
+    """
+    out = np.empty(lats.shape[0])
+    for i in range(lats.shape[0]):
+        lat = math.radians(lats[i])
+        lon = math.radians(lons[i])
+        h = (
+            math.sin((lat - rlat) / 2) ** 2
+            + math.cos(lat) * cos_rlat * math.sin((lon - rlon) / 2) ** 2
+        )
+        out[i] = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+    return out
+
+
+@lru_cache(maxsize=None)
+def _haversine_km_jit():
+    """
+    _haversine_km_loop compiled with Numba (LLVM vectorizes it under
+    fastmath), or None when Numba isn't installed.
+    """
+    try:
+        import numba
+    except ImportError:  # optional: falls back to the NumPy and math kernels
+        return None
+    return numba.njit(cache=True, fastmath=True)(_haversine_km_loop)
+
 
-import osxphotos
-from geopy.distance import geodesic
-from geopy.geocoders import Nominatim
-from PIL import Image
+@lru_cache(maxsize=None)
+def _ball_tree_cls():
+    """
+    scikit-learn's BallTree, or None when scikit-learn isn't installed.
+    """
+    try:
+        from sklearn.neighbors import BallTree
+    except ImportError:  # optional: falls back to a full scan per filter_media call
+        return None
+    return BallTree
+
+
+@lru_cache(maxsize=8)
+def _load_config(path: str, mtime_ns: int) -> dict:
+    """
+    Parse a TOML config file. mtime_ns is only part of the cache key, so an
+    edited file is re-read.
+    """
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _make_thumb(
+    path: str, filename: str, thumb_size: Tuple[int, int]
+) -> Optional[bytes]:
+    """
+    Create a single thumbnail and return it encoded in the format implied by
+    filename, or None if the image can't be read. Module-level so it can be
+    pickled for the process pool used by MacPhotosFilter.save_thumbnails.
+    """
+    from PIL import Image
+
+    try:
+        img = Image.open(path)
+        # Let libjpeg decode at a reduced 1/2, 1/4 or 1/8 scale (no-op for
+        # non-JPEG), keeping 2x the thumbnail size for the Lanczos pass
+        img.draft("RGB", (thumb_size[0] * 2, thumb_size[1] * 2))
+        img.thumbnail(thumb_size, Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        fmt = Image.registered_extensions().get(Path(filename).suffix.lower())
+        img.save(buf, format=fmt, quality=85, optimize=False)
+        return buf.getvalue()
+    except Exception as e:
+        print(f"Error creating thumbnail for {filename}: {e}")
+        return None
 
 
 class MacPhotosFilter:
@@ -15,6 +168,8 @@ class MacPhotosFilter:
     by date, location, and media type, with config file support.
     """
 
+    _photosdb_cache: ClassVar[Dict[str, osxphotos.PhotosDB]] = {}
+
     def __init__(
         self,
         start_date: datetime = datetime(1970, 1, 1),
@@ -23,9 +178,10 @@ class MacPhotosFilter:
         config_path: str = "config.toml",
         max_distance_km: Optional[float] = None,
     ):
-        # Load config
-        with open(config_path, "rb") as f:
-            self.config = tomllib.load(f)
+        # Load config (parsed once per path and modification time); copied so
+        # changes to one instance's config don't leak into the cache
+        path = Path(config_path).resolve()
+        self.config = copy.deepcopy(_load_config(str(path), path.stat().st_mtime_ns))
         defaults = self.config.get("defaults", {})
         self.home_address = defaults.get("home_address")
         self.max_distance_km = (
@@ -33,10 +189,7 @@ class MacPhotosFilter:
             if max_distance_km is not None
             else float(defaults.get("max_distance_km", 2.0))
         )
-        self.start_date = start_date
-        self.end_date = (
-            end_date if end_date is not None else datetime.now() - timedelta(days=1)
-        )
+        self.set_date_range(start_date, end_date)
         # Set target location
         if target_location:
             self.target_location = target_location
@@ -52,17 +205,83 @@ class MacPhotosFilter:
             raise ValueError(
                 "Must specify either target_location or home_address or target_latlon in config"
             )
-        self.photosdb = osxphotos.PhotosDB()
+        self.photosdb = self._load_photosdb(defaults.get("library_path"))
         self.filtered_media: List[osxphotos.PhotoInfo] = []
+        # Column buffers and spatial index over the media matching the last
+        # filter_media date range and media type
+        self._columns_query: Optional[Tuple[datetime, datetime, str]] = None
+        self._media: Optional[List[osxphotos.PhotoInfo]] = None
+        self._coord_buf: Optional[np.ndarray] = None
+        self._date_buf: Optional[np.ndarray] = None
+        self._kind_buf: Optional[np.ndarray] = None
+        self._located: Optional[np.ndarray] = None
+        self._tree = None
+
+    @property
+    def target_location(self) -> Tuple[float, float]:
+        return self._target_location
+
+    @target_location.setter
+    def target_location(self, location: Tuple[float, float]) -> None:
+        # Keep the radian form alongside so the distance kernels don't
+        # re-convert the target on every call
+        self._target_location = location
+        self._target_rad = (math.radians(location[0]), math.radians(location[1]))
+        self._cos_tlat = math.cos(self._target_rad[0])
+
+    @classmethod
+    def _load_photosdb(cls, library_path: Optional[str] = None) -> osxphotos.PhotosDB:
+        """
+        Parsing the Photos library is slow, so share one PhotosDB per library
+        path across instances. None means the system Photos library; other
+        paths are resolved so different spellings share one entry.
+        """
+        if library_path:
+            key = str(Path(library_path).expanduser().resolve())
+            args = [key]
+        else:
+            key, args = "_default_", []
+        if key not in cls._photosdb_cache:
+            import osxphotos
+
+            cls._photosdb_cache[key] = osxphotos.PhotosDB(*args)
+        return cls._photosdb_cache[key]
 
     @staticmethod
     def address_to_gps(
         address: str, user_agent: str = "macphotosfilter"
     ) -> Optional[Tuple[float, float]]:
+        """
+        Geocode an address with Nominatim. Successful results are memoized
+        in-process and persisted to GEOCACHE_PATH for GEOCACHE_TTL, so repeat
+        lookups skip the rate-limited HTTP call; failed lookups are retried.
+        An unusable cache file (e.g. read-only home) just means a live lookup.
+        """
+        memo_key = (address, user_agent)
+        if memo_key in _geocode_memo:
+            return _geocode_memo[memo_key]
+        key = f"{user_agent}\n{address}"
+        try:
+            with shelve.open(str(GEOCACHE_PATH)) as cache:
+                hit = cache.get(key)
+        except (OSError, *dbm.error):
+            hit = None
+        if hit and time.time() - hit[2] < GEOCACHE_TTL.total_seconds():
+            _geocode_memo[memo_key] = (hit[0], hit[1])
+            return _geocode_memo[memo_key]
+        from geopy.geocoders import Nominatim
+
         geolocator = Nominatim(user_agent=user_agent)
         location = geolocator.geocode(address)
         if location:
-            return (location.latitude, location.longitude)
+            coords = (location.latitude, location.longitude)
+            _geocode_memo[memo_key] = coords
+            try:
+                with shelve.open(str(GEOCACHE_PATH)) as cache:
+                    cache[key] = (*coords, time.time())
+            except (OSError, *dbm.error):
+                pass
+            return coords
         return None
 
     def set_date_range(
@@ -86,6 +305,114 @@ class MacPhotosFilter:
     def set_distance_km(self, distance: float) -> None:
         self.max_distance_km = distance
 
+    @staticmethod
+    def _bbox_half_widths(cos_lat: float, radius_km: float) -> Tuple[float, float]:
+        """
+        Half-widths in degrees (lat, lon) of the box enclosing a circle of
+        radius_km around a point whose latitude has cosine cos_lat.
+        """
+        angular = radius_km / EARTH_RADIUS_KM
+        dlat = np.degrees(angular)
+        sin_ratio = np.sin(angular) / cos_lat
+        # Circle reaches a pole or covers a hemisphere: no longitude bound
+        if angular < np.pi / 2 and 0 <= sin_ratio < 1:
+            dlon = np.degrees(np.arcsin(sin_ratio))
+        else:
+            dlon = 180.0
+        return float(dlat), float(dlon)
+
+    def _build_columns(self, media: Iterable[osxphotos.PhotoInfo]) -> None:
+        """
+        Extract the per-media fields the filters need into contiguous NumPy
+        columns (struct-of-arrays), so every predicate is a vectorized mask
+        op instead of a Python attribute lookup per photo. Media without a
+        location get NaN coordinates and never match.
+        """
+        # photos() returns a set-ordered list when filtering; sort by date so
+        # results (and which media save_thumbnails picks) are deterministic
+        self._media = sorted(media, key=attrgetter("date"))
+        self._tree = None
+        n = len(self._media)
+        coords = np.full((n, 2), np.nan, dtype=np.float64)
+        dates = np.empty(n, dtype="datetime64[us]")
+        kinds = np.zeros(n, dtype=np.uint8)
+        for i, p in enumerate(self._media):
+            loc = p.location
+            if loc and loc[0] is not None:
+                coords[i] = loc[:2]
+            dates[i] = _to_datetime64(p.date)
+            kinds[i] = (_KIND_PHOTO if p.isphoto else 0) | (
+                _KIND_VIDEO if p.ismovie else 0
+            )
+        self._coord_buf = coords
+        self._date_buf = dates
+        self._kind_buf = kinds
+
+        BallTree = _ball_tree_cls()
+        if BallTree is not None:
+            self._located = np.flatnonzero(~np.isnan(coords[:, 0]))
+            if len(self._located):
+                self._tree = BallTree(
+                    np.radians(coords[self._located]), metric="haversine"
+                )
+
+    def _rows_within_radius(self, keep: np.ndarray) -> np.ndarray:
+        """
+        Sorted column indices of media selected by the boolean mask keep that
+        are within max_distance_km of target_location.
+        """
+        if _ball_tree_cls() is not None:
+            if self._tree is None:
+                return np.empty(0, dtype=np.intp)
+            idx = self._tree.query_radius(
+                np.array([self._target_rad]),
+                r=self.max_distance_km / EARTH_RADIUS_KM,
+            )[0]
+            rows = self._located[np.sort(idx)]
+            return rows[keep[rows]]
+
+        rows = np.flatnonzero(keep)
+        lats, lons = self._coord_buf[rows, 0], self._coord_buf[rows, 1]
+        tlat, tlon = self.target_location
+
+        # Cheap bounding-box reject so trig only runs on nearby candidates
+        dlat_max, dlon_max = self._bbox_half_widths(
+            self._cos_tlat, self.max_distance_km
+        )
+        dlon = np.abs((lons - tlon + 180.0) % 360.0 - 180.0)
+        candidates = np.flatnonzero(
+            (np.abs(lats - tlat) <= dlat_max) & (dlon <= dlon_max)
+        )
+
+        haversine_jit = _haversine_km_jit()
+        if haversine_jit is not None:
+            d_km = haversine_jit(
+                lats[candidates], lons[candidates], *self._target_rad, self._cos_tlat
+            )
+            return rows[candidates[d_km <= self.max_distance_km]]
+
+        if len(candidates) <= SCALAR_MAX_CANDIDATES:
+            return np.array(
+                [
+                    rows[i]
+                    for i in candidates
+                    if haversine_km(self.target_location, (lats[i], lons[i]))
+                    <= self.max_distance_km
+                ],
+                dtype=np.intp,
+            )
+
+        # Vectorized haversine distance from the target to the survivors
+        clat = np.radians(lats[candidates])
+        clon = np.radians(lons[candidates])
+        rlat, rlon = self._target_rad
+        a = (
+            np.sin((clat - rlat) / 2) ** 2
+            + np.cos(clat) * self._cos_tlat * np.sin((clon - rlon) / 2) ** 2
+        )
+        d_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        return rows[candidates[d_km <= self.max_distance_km]]
+
     def filter_media(self, media_type="all"):
         # Ensure start/end dates are timezone-aware (UTC)
         if self.start_date.tzinfo is None:
@@ -93,24 +420,35 @@ class MacPhotosFilter:
         if self.end_date.tzinfo is None:
             self.end_date = self.end_date.replace(tzinfo=timezone.utc)
 
-        media = [
-            p
-            for p in self.photosdb.photos()
-            if self.start_date <= p.date <= self.end_date
-            and (
-                (media_type == "all")
-                or (media_type == "photo" and p.isphoto)
-                or (media_type == "video" and p.ismovie)
+        # Let osxphotos apply the date range and media type, and rebuild the
+        # columns (and index) only when those change; location/distance can
+        # then be re-filtered against the cached columns. photos() keeps
+        # from_date <= date < to_date, so to_date is moved one microsecond
+        # (datetime's resolution) past end_date to keep end_date inclusive.
+        query = (self.start_date, self.end_date, media_type)
+        if query != self._columns_query:
+            self._build_columns(
+                self.photosdb.photos(
+                    from_date=self.start_date,
+                    to_date=self.end_date + _ONE_MICROSECOND,
+                    images=media_type != "video",
+                    movies=media_type != "photo",
+                )
             )
-        ]
+            self._columns_query = query
 
-        self.filtered_media = [
-            m
-            for m in media
-            if m.location
-            and geodesic(self.target_location, (m.location[0], m.location[1])).km
-            <= self.max_distance_km
-        ]
+        # Date and media-type masks before any trig. Redundant with the query
+        # above, but cheap, and they keep the result exact should photos()
+        # return a superset (masks can only remove rows, never restore them).
+        keep = (self._date_buf >= _to_datetime64(self.start_date)) & (
+            self._date_buf <= _to_datetime64(self.end_date)
+        )
+        if media_type != "all":
+            kind = _MEDIA_TYPE_KINDS.get(media_type, 0)
+            keep &= (self._kind_buf & kind) != 0
+
+        rows = self._rows_within_radius(keep)
+        self.filtered_media = [self._media[i] for i in rows]
         return self.filtered_media
 
     def save_thumbnails(
@@ -118,6 +456,7 @@ class MacPhotosFilter:
         out_dir: str,
         thumb_size: Tuple[int, int] = (300, 300),
         max_media: int = 10,
+        max_workers: Optional[int] = None,
     ) -> None:
         """
         Save thumbnails of filtered media to a directory.
@@ -125,47 +464,98 @@ class MacPhotosFilter:
             out_dir (str): Directory to save thumbnails.
             thumb_size (Tuple[int, int]): Thumbnail size.
             max_media (int): Maximum number of thumbnails to save.
+            max_workers (Optional[int]): Worker processes to use (defaults to
+                the CPU count); 1 creates the thumbnails in this process.
         """
         out_path = Path(out_dir)
         out_path.mkdir(parents=True, exist_ok=True)
-        count = 0
-        for media in self.filtered_media:
-            if count >= max_media:
-                break
-            try:
-                img = Image.open(media.path)
-                img.thumbnail(thumb_size)
-                thumb_file = out_path / f"thumb_{count}_{media.filename}"
-                img.save(thumb_file)
-                count += 1
-            except Exception as e:
-                print(f"Error creating thumbnail for {media.filename}: {e}")
-
-    def list_media_info(self) -> List[dict]:
-        info_list = []
-        for media in self.filtered_media:
-            info = {
-                "filename": media.filename,
-                "date": media.date,
-                "location": media.location,
-                "path": media.path,
-                "type": "photo" if media.isphoto else "video",
-            }
-            info_list.append(info)
-        return info_list
+        # Videos and media whose original isn't on disk (e.g. in an
+        # iCloud-optimised library) can't be thumbnailed; don't spend slots
+        pending = [
+            m for m in self.filtered_media if m.path is not None and not m.ismovie
+        ]
+        if not pending:
+            return
+        make_thumb = partial(_make_thumb, thumb_size=thumb_size)
+        with ExitStack() as stack:
+            if max_workers == 1:
+                mapper = map
+            else:
+                ex = stack.enter_context(
+                    ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+                )
+                mapper = partial(ex.map, chunksize=4)
+            count = 0
+            while count < max_media and pending:
+                # Submit just enough to fill the remaining slots; items that
+                # fail are replaced from the next batch, and numbering only
+                # advances on success
+                batch = pending[: max_media - count]
+                pending = pending[max_media - count :]
+                thumbs = mapper(
+                    make_thumb, [m.path for m in batch], [m.filename for m in batch]
+                )
+                for media, thumb in zip(batch, thumbs):
+                    if thumb is not None:
+                        thumb_file = out_path / f"thumb_{count}_{media.filename}"
+                        thumb_file.write_bytes(thumb)
+                        count += 1
+
+    def list_media_info(self) -> List[MediaInfo]:
+        return [
+            MediaInfo(
+                media.filename,
+                media.date,
+                media.location,
+                media.path,
+                "photo" if media.isphoto else "video",
+            )
+            for media in self.filtered_media
+        ]
 
     def save_filtered_media_paths(self, filepath: str) -> None:
-        with open(filepath, "w") as f:
-            for media in self.filtered_media:
-                f.write(f"{media.path}\n")
+        with open(filepath, "w", buffering=1 << 20) as f:
+            f.writelines(f"{media.path}\n" for media in self.filtered_media)
 
     def export_filtered_media(
-        self, export_dir: str, original: bool = True, edited: bool = False
+        self,
+        export_dir: str,
+        original: bool = True,
+        edited: bool = False,
+        max_workers: int = 8,
     ) -> None:
+        """
+        Export the filtered media to a directory.
+        Args:
+            export_dir (str): Directory to export to.
+            original (bool): Export the original of each item.
+            edited (bool): Export the edited version of each item (osxphotos
+                raises for items without one).
+            max_workers (int): Export threads to use.
+        """
         export_path = Path(export_dir)
         export_path.mkdir(parents=True, exist_ok=True)
+        # Export is I/O-bound, so threads overlap the file copies. export()
+        # names files after original_filename (PhotoInfo.filename is the
+        # unique UUID-based library name): "<stem><ext>" for originals and
+        # "<stem>_edited<edited ext>" for edits, so IMG_0001.HEIC and
+        # IMG_0001.JPG can both write IMG_0001_edited.jpeg. Media sharing a
+        # stem go to the same task so osxphotos' collision renaming
+        # ("name (1).jpg") never races between threads.
+        by_stem: Dict[str, List[osxphotos.PhotoInfo]] = defaultdict(list)
         for media in self.filtered_media:
-            media.export(str(export_path), original=original, edited=edited)
+            stem = Path(media.original_filename or media.filename).stem
+            by_stem[stem.lower()].append(media)
+
+        def export_group(group: List[osxphotos.PhotoInfo]) -> None:
+            for media in group:
+                if original:
+                    media.export(str(export_path))
+                if edited:
+                    media.export(str(export_path), edited=True)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            list(ex.map(export_group, by_stem.values()))
 
     def clear_filters(self) -> None:
         self.filtered_media = []
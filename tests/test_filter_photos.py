@@ -1,9 +1,19 @@
+import os
+import sys
+import time
 import pytest
 from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import numpy as np
+
+import scripts.filter_photos as filter_photos
 from scripts.filter_photos import (
     MacPhotosFilter,
+    MediaInfo,
+    haversine_km,
 )
 
 
@@ -19,6 +29,7 @@ def mock_photosdb(monkeypatch):
             ismovie,
             filename="test.jpg",
             path="/tmp/test.jpg",
+            original_filename="IMG_0001.JPG",
         ):
             self.date = date
             self.location = location
@@ -26,9 +37,10 @@ def mock_photosdb(monkeypatch):
             self.ismovie = ismovie
             self.filename = filename
             self.path = path
+            self.original_filename = original_filename
 
-        def export(self, export_dir, original=True, edited=False):
-            return True
+        def export(self, dest, filename=None, edited=False):
+            return [dest]
 
     # Mock PhotosDB
     mock_db = MagicMock()
@@ -38,13 +50,14 @@ def mock_photosdb(monkeypatch):
             now - timedelta(days=1), (-33.85, 151.15), True, False
         ),  # photo, in range
         MockPhotoInfo(
-            now - timedelta(days=2), (-33.90, 151.20), True, False
+            now - timedelta(days=2), (-34.00, 151.30), True, False
         ),  # photo, out of range
         MockPhotoInfo(
             now - timedelta(days=1), (-33.85, 151.15), False, True
         ),  # video, in range
     ]
-    monkeypatch.setattr("osxphotos.PhotosDB", lambda: mock_db)
+    # Seed the PhotosDB cache so osxphotos is never imported
+    monkeypatch.setattr(MacPhotosFilter, "_photosdb_cache", {"_default_": mock_db})
     return mock_db
 
 
@@ -91,6 +104,25 @@ def test_filter_all_in_range(mock_photosdb, default_config):
     assert len(pf.filtered_media) == 2  # photo + video in range
 
 
+def test_filter_pushes_date_and_type_to_query(mock_photosdb, default_config):
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        config_path=default_config,
+    )
+    pf.filter_media(media_type="video")
+    mock_photosdb.photos.assert_called_once_with(
+        from_date=pf.start_date,
+        to_date=pf.end_date + timedelta(microseconds=1),
+        images=False,
+        movies=True,
+    )
+    # Re-filtering by location reuses the columns from the previous query
+    pf.set_distance_km(1.0)
+    pf.filter_media(media_type="video")
+    assert mock_photosdb.photos.call_count == 1
+
+
 def test_no_media_out_of_range(mock_photosdb, tmp_path):
     config_path = tmp_path / "config.toml"
     config_path.write_text("""
@@ -107,6 +139,200 @@ target_latlon = [0.0, 0.0]
     assert len(pf.filtered_media) == 0
 
 
+def test_haversine_km():
+    sydney, melbourne = (-33.8688, 151.2093), (-37.8136, 144.9631)
+    assert haversine_km(sydney, sydney) == 0.0
+    assert haversine_km(sydney, melbourne) == pytest.approx(713.4, abs=0.5)
+
+
+def _media_near(target, spread_deg, n, seed=0):
+    """n located photos scattered within +-spread_deg of target."""
+    rng = np.random.default_rng(seed)
+    lats = np.clip(target[0] + rng.uniform(-spread_deg, spread_deg, n), -90, 90)
+    lons = (target[1] + rng.uniform(-spread_deg, spread_deg, n) + 180) % 360 - 180
+    date = datetime.now() - timedelta(days=1)
+    return [
+        SimpleNamespace(
+            date=date,
+            location=(float(lat), float(lon)),
+            isphoto=True,
+            ismovie=False,
+            filename=f"{i}.jpg",
+        )
+        for i, (lat, lon) in enumerate(zip(lats, lons))
+    ]
+
+
+def _assert_matches_brute_force(mock_photosdb, config_path, media, target, radius):
+    mock_photosdb.photos.return_value = media
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        target_location=target,
+        max_distance_km=radius,
+        config_path=config_path,
+    )
+    got = [m.filename for m in pf.filter_media(media_type="all")]
+    expected = [m.filename for m in media if haversine_km(target, m.location) <= radius]
+    assert sorted(got) == sorted(expected)
+    assert 0 < len(expected) < len(media)
+
+
+RADIUS_CASES = {
+    "antimeridian": ((0.0, 179.95), 1.0, 40.0),
+    "near_pole": ((89.8, 10.0), 0.5, 30.0),
+    "whole_globe": ((-33.85, 151.15), 180.0, 12000.0),
+}
+
+
+@pytest.fixture
+def scan_only(monkeypatch):
+    # Force the bbox + NumPy/scalar haversine scan regardless of extras
+    monkeypatch.setattr(filter_photos, "_ball_tree_cls", lambda: None)
+    monkeypatch.setattr(filter_photos, "_haversine_km_jit", lambda: None)
+
+
+@pytest.mark.parametrize("case", RADIUS_CASES)
+def test_scan_matches_brute_force_vectorized(
+    monkeypatch, scan_only, mock_photosdb, default_config, case
+):
+    target, spread, radius = RADIUS_CASES[case]
+    calls = []
+    monkeypatch.setattr(
+        filter_photos,
+        "haversine_km",
+        lambda a, b: calls.append(1) or haversine_km(a, b),
+    )
+    media = _media_near(target, spread, 400)
+    _assert_matches_brute_force(mock_photosdb, default_config, media, target, radius)
+    # > SCALAR_MAX_CANDIDATES survivors: the NumPy kernel, not the scalar one
+    assert calls == []
+
+
+@pytest.mark.parametrize("case", RADIUS_CASES)
+def test_scan_matches_brute_force_scalar(
+    monkeypatch, scan_only, mock_photosdb, default_config, case
+):
+    target, spread, radius = RADIUS_CASES[case]
+    calls = []
+    monkeypatch.setattr(
+        filter_photos,
+        "haversine_km",
+        lambda a, b: calls.append(1) or haversine_km(a, b),
+    )
+    media = _media_near(target, spread, filter_photos.SCALAR_MAX_CANDIDATES, seed=1)
+    _assert_matches_brute_force(mock_photosdb, default_config, media, target, radius)
+    assert 0 < len(calls) <= filter_photos.SCALAR_MAX_CANDIDATES
+
+
+@pytest.mark.parametrize("case", RADIUS_CASES)
+def test_jit_kernel_matches_brute_force(
+    monkeypatch, mock_photosdb, default_config, case
+):
+    # Run _haversine_km_loop uncompiled in place of the Numba kernel
+    monkeypatch.setattr(filter_photos, "_ball_tree_cls", lambda: None)
+    monkeypatch.setattr(
+        filter_photos, "_haversine_km_jit", lambda: filter_photos._haversine_km_loop
+    )
+    target, spread, radius = RADIUS_CASES[case]
+    media = _media_near(target, spread, 400)
+    _assert_matches_brute_force(mock_photosdb, default_config, media, target, radius)
+
+
+def test_haversine_km_loop_matches_scalar():
+    rng = np.random.default_rng(2)
+    lats, lons = rng.uniform(-90, 90, 50), rng.uniform(-180, 180, 50)
+    target = (-33.85, 151.15)
+    rlat, rlon = np.radians(target)
+    d_km = filter_photos._haversine_km_loop(lats, lons, rlat, rlon, np.cos(rlat))
+    expected = [haversine_km(target, (lat, lon)) for lat, lon in zip(lats, lons)]
+    assert d_km == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("case", RADIUS_CASES)
+def test_ball_tree_matches_brute_force(mock_photosdb, default_config, case):
+    pytest.importorskip("sklearn")
+    assert filter_photos._ball_tree_cls() is not None
+    target, spread, radius = RADIUS_CASES[case]
+    media = _media_near(target, spread, 400)
+    _assert_matches_brute_force(mock_photosdb, default_config, media, target, radius)
+
+
+def test_config_cached_per_instance_copy_and_reparsed_on_edit(
+    mock_photosdb, default_config
+):
+    pf1 = MacPhotosFilter(config_path=default_config)
+    pf1.config["defaults"]["max_distance_km"] = 99.0
+    pf2 = MacPhotosFilter(config_path=default_config)
+    assert pf2.max_distance_km == 10.0
+    config_path = Path(default_config)
+    config_path.write_text("""
+[defaults]
+max_distance_km = 3.0
+target_latlon = [-33.85, 151.15]
+""")
+    # Force a new mtime even on filesystems with coarse timestamps
+    st = config_path.stat()
+    os.utime(config_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    pf3 = MacPhotosFilter(config_path=default_config)
+    assert pf3.max_distance_km == 3.0
+
+
+def test_photosdb_shared_across_instances(mock_photosdb, default_config):
+    pf1 = MacPhotosFilter(config_path=default_config)
+    pf2 = MacPhotosFilter(config_path=default_config)
+    assert pf1.photosdb is pf2.photosdb is mock_photosdb
+
+
+def test_photosdb_keyed_by_resolved_library_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(MacPhotosFilter, "_photosdb_cache", {})
+    monkeypatch.setenv("HOME", str(tmp_path))
+    fake_osxphotos = SimpleNamespace(
+        PhotosDB=MagicMock(side_effect=lambda path: object())
+    )
+    monkeypatch.setitem(sys.modules, "osxphotos", fake_osxphotos)
+    library = tmp_path / "Pictures" / "Photos Library.photoslibrary"
+    library.mkdir(parents=True)
+    spellings = [
+        "~/Pictures/Photos Library.photoslibrary",
+        str(library),
+        str(tmp_path / "Pictures" / ".." / "Pictures" / library.name),
+    ]
+    dbs = {id(MacPhotosFilter._load_photosdb(p)) for p in spellings}
+    assert len(dbs) == 1
+    fake_osxphotos.PhotosDB.assert_called_once_with(str(library.resolve()))
+
+
+def test_list_media_info(mock_photosdb, default_config):
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        config_path=default_config,
+    )
+    pf.filter_media(media_type="all")
+    info = pf.list_media_info()
+    assert [i.type for i in info] == ["photo", "video"]
+    assert info[0] == MediaInfo(
+        "test.jpg",
+        pf.filtered_media[0].date,
+        (-33.85, 151.15),
+        "/tmp/test.jpg",
+        "photo",
+    )
+
+
+def test_save_filtered_media_paths(tmp_path, mock_photosdb, default_config):
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        config_path=default_config,
+    )
+    pf.filter_media(media_type="all")
+    out_file = tmp_path / "paths.txt"
+    pf.save_filtered_media_paths(str(out_file))
+    assert out_file.read_text() == "/tmp/test.jpg\n/tmp/test.jpg\n"
+
+
 def test_export_filtered_media(tmp_path, mock_photosdb, default_config):
     pf = MacPhotosFilter(
         start_date=datetime.now() - timedelta(days=3),
@@ -121,6 +347,41 @@ def test_export_filtered_media(tmp_path, mock_photosdb, default_config):
         assert hasattr(media, "export")
 
 
+def test_export_same_original_name_not_concurrent(
+    tmp_path, mock_photosdb, default_config
+):
+    pf = MacPhotosFilter(config_path=default_config)
+    active, overlaps, exported = set(), [], []
+
+    class Media:
+        def __init__(self, filename, original_filename):
+            self.filename = filename
+            self.original_filename = original_filename
+
+        def export(self, dest, filename=None, edited=False):
+            # Same naming as osxphotos: edits are "<stem>_edited<edited ext>"
+            original = Path(self.original_filename)
+            name = f"{original.stem}_edited.jpeg" if edited else original.name
+            name = name.lower()
+            if name in active:
+                overlaps.append(name)
+            active.add(name)
+            time.sleep(0.01)
+            active.discard(name)
+            exported.append((self.filename, edited))
+            return [str(Path(dest) / name)]
+
+    originals = ["IMG_0001.JPG", "img_0001.jpg", "IMG_0002.HEIC", "IMG_0002.JPG"]
+    pf.filtered_media = [
+        Media(f"{uuid}.jpeg", original) for uuid, original in enumerate(originals * 3)
+    ]
+    pf.export_filtered_media(str(tmp_path / "export"), edited=True)
+    assert sorted(exported) == sorted(
+        (m.filename, edited) for m in pf.filtered_media for edited in (False, True)
+    )
+    assert overlaps == []
+
+
 def test_save_thumbnails(tmp_path, mock_photosdb, default_config):
     pf = MacPhotosFilter(
         start_date=datetime.now() - timedelta(days=3),
@@ -129,15 +390,66 @@ def test_save_thumbnails(tmp_path, mock_photosdb, default_config):
     )
     pf.filter_media(media_type="all")
     thumb_dir = tmp_path / "thumbs"
-    # Patch PIL.Image.open to avoid real file I/O
+    # Patch PIL.Image.open to avoid real file I/O; run in-process so the
+    # patch is visible to the thumbnail worker
     with patch("PIL.Image.open") as mock_open:
         mock_img = MagicMock()
         mock_open.return_value = mock_img
-        pf.save_thumbnails(str(thumb_dir))
+        pf.save_thumbnails(str(thumb_dir), max_workers=1)
         assert mock_open.called
 
 
-def test_set_location_by_address(monkeypatch, default_config):
+def test_save_thumbnails_parallel(tmp_path, mock_photosdb, default_config):
+    from PIL import Image
+
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        config_path=default_config,
+    )
+    pf.filtered_media = []
+    for i in range(3):
+        path = tmp_path / f"img{i}.jpg"
+        Image.new("RGB", (640, 480)).save(path)
+        pf.filtered_media.append(
+            SimpleNamespace(path=str(path), filename=path.name, ismovie=False)
+        )
+    thumb_dir = tmp_path / "thumbs"
+    pf.save_thumbnails(str(thumb_dir), thumb_size=(64, 64), max_media=2)
+    thumbs = sorted(thumb_dir.iterdir())
+    assert [t.name for t in thumbs] == ["thumb_0_img0.jpg", "thumb_1_img1.jpg"]
+    assert max(Image.open(thumbs[0]).size) == 64
+
+
+def test_save_thumbnails_skips_unusable_media(tmp_path, mock_photosdb, default_config):
+    from PIL import Image
+
+    pf = MacPhotosFilter(
+        start_date=datetime.now() - timedelta(days=3),
+        end_date=datetime.now(),
+        config_path=default_config,
+    )
+    good = tmp_path / "good.jpg"
+    Image.new("RGB", (640, 480)).save(good)
+    corrupt = tmp_path / "corrupt.jpg"
+    corrupt.write_bytes(b"not a jpeg")
+    pf.filtered_media = [
+        SimpleNamespace(path=None, filename="icloud.jpg", ismovie=False),
+        SimpleNamespace(path=str(good), filename="clip.mov", ismovie=True),
+        SimpleNamespace(path=str(corrupt), filename="corrupt.jpg", ismovie=False),
+        SimpleNamespace(path=str(good), filename="a.jpg", ismovie=False),
+        SimpleNamespace(path=str(good), filename="b.jpg", ismovie=False),
+    ]
+    thumb_dir = tmp_path / "thumbs"
+    pf.save_thumbnails(str(thumb_dir), max_media=2, max_workers=1)
+    # The unreadable item is replaced and numbering has no gaps
+    assert sorted(t.name for t in thumb_dir.iterdir()) == [
+        "thumb_0_a.jpg",
+        "thumb_1_b.jpg",
+    ]
+
+
+def test_set_location_by_address(monkeypatch, mock_photosdb, default_config):
     pf = MacPhotosFilter(
         start_date=datetime.now() - timedelta(days=3),
         end_date=datetime.now(),
@@ -149,7 +461,39 @@ def test_set_location_by_address(monkeypatch, default_config):
     assert pf.target_location == (1.0, 2.0)
 
 
-def test_set_location_by_gps(default_config):
+@pytest.fixture
+def geocoder(monkeypatch, tmp_path):
+    monkeypatch.setattr("scripts.filter_photos.GEOCACHE_PATH", tmp_path / "geocache")
+    monkeypatch.setattr("scripts.filter_photos._geocode_memo", {})
+    geocoder = MagicMock()
+    geocoder.geocode.return_value = SimpleNamespace(latitude=1.0, longitude=2.0)
+    monkeypatch.setattr("geopy.geocoders.Nominatim", lambda user_agent: geocoder)
+    return geocoder
+
+
+def test_address_to_gps_cached(monkeypatch, geocoder):
+    assert MacPhotosFilter.address_to_gps("test address") == (1.0, 2.0)
+    # Persistent cache is hit even after the in-process cache is dropped
+    monkeypatch.setattr("scripts.filter_photos._geocode_memo", {})
+    assert MacPhotosFilter.address_to_gps("test address") == (1.0, 2.0)
+    assert geocoder.geocode.call_count == 1
+
+
+def test_address_to_gps_retries_failures(geocoder):
+    geocoder.geocode.return_value = None
+    assert MacPhotosFilter.address_to_gps("test address") is None
+    geocoder.geocode.return_value = SimpleNamespace(latitude=1.0, longitude=2.0)
+    assert MacPhotosFilter.address_to_gps("test address") == (1.0, 2.0)
+    assert geocoder.geocode.call_count == 2
+
+
+def test_address_to_gps_unusable_cache(monkeypatch, tmp_path, geocoder):
+    missing_dir = tmp_path / "missing" / "geocache"
+    monkeypatch.setattr("scripts.filter_photos.GEOCACHE_PATH", missing_dir)
+    assert MacPhotosFilter.address_to_gps("test address") == (1.0, 2.0)
+
+
+def test_set_location_by_gps(mock_photosdb, default_config):
     pf = MacPhotosFilter(
         start_date=datetime.now() - timedelta(days=3),
         end_date=datetime.now(),
@@ -159,7 +503,7 @@ def test_set_location_by_gps(default_config):
     assert pf.target_location == (5.0, 6.0)
 
 
-def test_set_distance_km(default_config):
+def test_set_distance_km(mock_photosdb, default_config):
     pf = MacPhotosFilter(
         start_date=datetime.now() - timedelta(days=3),
         end_date=datetime.now(),